@@ -1,8 +1,14 @@
 import os
-import time
+import re
+import asyncio
 import logging
-import requests
+import functools
+import unicodedata
+import httpx
+import orjson
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import LRUCache, TLRUCache
 from PIL import Image, ImageDraw, ImageFont
 from telegram import Update
 from telegram.ext import (
@@ -28,123 +34,390 @@ if not TELEGRAM_TOKEN or not WEATHER_API_KEY:
     logger.error("Необходимо установить переменные окружения TELEGRAM_TOKEN и WEATHER_API_KEY")
     exit(1)
 
-# Настройки кэширования (10 минут)
+# Настройки кэширования (не более 1024 населённых пунктов).
+# Время жизни записи зависит от погоды: ясная меняется медленно,
+# дождь и гроза – быстро. Для прочих состояний – CACHE_TTL (10 минут).
 CACHE_TTL = 600
-weather_cache = {}  # {location.lower(): (timestamp, current_data, forecast_data)}
+CACHE_MAXSIZE = 1024
+TTL_BY_STATE = {
+    "Clear": 1800,
+    "Clouds": 900,
+    "Rain": 300,
+    "Drizzle": 300,
+    "Snow": 300,
+    "Thunderstorm": 120,
+}
 
-def get_weather(location: str):
+def weather_ttu(key, value, now):
+    """Момент истечения записи кэша по состоянию текущей погоды."""
+    current_data, _ = value
+    main_weather = current_data["weather"][0]["main"]
+    return now + TTL_BY_STATE.get(main_weather, CACHE_TTL)
+
+weather_cache = TLRUCache(maxsize=CACHE_MAXSIZE, ttu=weather_ttu)  # {(lat, lon): (current_data, hourly_data)}
+
+# Готовые закодированные карточки по их содержимому: фон + оба текста однозначно задают
+# картинку, поэтому запись не устаревает и переживает обновление погоды,
+# если округлённые значения не изменились
+CARD_CACHE_MAXSIZE = 256
+card_cache = LRUCache(maxsize=CARD_CACHE_MAXSIZE)  # {(main_weather, weather_values, forecast_line): image_bytes}
+
+# "Moscow", "moscow,ru" и "55.75, 37.62" – одно и то же место, поэтому кэш
+# погоды ведётся по координатам (с точностью до 0.01°). Названия один раз
+# переводятся в координаты через геокодер OWM; результат не устаревает.
+# Ненайденные названия тоже запоминаются (None), чтобы опечатки не ходили в сеть.
+geo_cache = LRUCache(maxsize=4 * CACHE_MAXSIZE)  # {key: (lat, lon) или None}, key – см. normalize_location
+# Между перезапусками найденные координаты сохраняются в файл (см. post_init/shutdown)
+GEO_CACHE_FILE = "geo_cache.json"
+
+# Запросы к OWM, которые выполняются прямо сейчас (single-flight)
+inflight = {}  # {(lat, lon) или key: asyncio.Task}
+
+# Координаты в формате "широта, долгота"
+COORD_RE = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$')
+
+# One Call 3.0 отдаёт текущую погоду и почасовой прогноз одним ответом
+ONECALL_URL = "https://api.openweathermap.org/data/3.0/onecall"
+GEOCODE_URL = "https://api.openweathermap.org/geo/1.0/direct"
+# Поля data["current"], без которых карточку не собрать
+CURRENT_KEYS = {"dt", "temp", "wind_speed", "weather"}
+
+# Таймауты запросов к OpenWeatherMap (connect 3 с, остальное 5 с)
+REQUEST_TIMEOUT = httpx.Timeout(5.0, connect=3.0)
+
+def load_background(path: str):
+    """
+    Загружает фоновое изображение в RGB: текст непрозрачный, альфа-канал не нужен.
+    Если файла нет – возвращает однотонный серый фон 800x400.
+    """
+    try:
+        with Image.open(path) as image:
+            return image.convert("RGB")
+    except IOError as e:
+        logger.warning(f"Фон {path} недоступен, используется серый: {e}")
+        return Image.new("RGB", (800, 400), (200, 200, 200))
+
+# Фон карточки по основному состоянию погоды (weather[0]["main"])
+BG_BY_WEATHER = {
+    "Clear": "assets/sunny.png",
+    "Rain": "assets/rain.png",
+    "Drizzle": "assets/rain.png",
+    "Snow": "assets/snow.png",
+    "Clouds": "assets/cloudy.png",
+    "Fog": "assets/fog.png",
+    "Mist": "assets/fog.png",
+    "Haze": "assets/fog.png",
+}
+DEFAULT_BG_PATH = "assets/default.png"
+
+# Особые фразы прогноза; для прочих состояний – "Прогноз: <описание>"
+FORECAST_PHRASE = {
+    "Rain": "Прогноз: дождь. Не забудьте взять зонт!",
+    "Drizzle": "Прогноз: морось. Не забудьте взять зонт!",
+}
+
+# Шрифт загружается один раз при старте, а не на каждый запрос
+try:
+    FONT = ImageFont.truetype("DejaVuSans.ttf", 36)
+except IOError:
+    FONT = ImageFont.load_default()
+
+# Холст 1x1 только для измерения текста: создаётся один раз, а не при каждом рендере
+MEASURE_DRAW = ImageDraw.Draw(Image.new("L", (1, 1)))
+
+# Разметка текста на карточке: строки идут с тем же шагом, что и у
+# multiline_text(..., spacing=8). Подписи строк 2–4 одинаковы на всех
+# карточках, поэтому рисуются на фонах заранее, а на запрос – только значения
+TEXT_X, TEXT_Y = 50, 50
+FORECAST_Y = 250
+LINE_HEIGHT = MEASURE_DRAW.textbbox((0, 0), "A", font=FONT)[3] + 8
+WEATHER_LABELS = ("Погода: ", "Температура: ", "Ветер: ")
+VALUE_X = [TEXT_X + round(MEASURE_DRAW.textlength(label, font=FONT)) for label in WEATHER_LABELS]
+
+def render_template(bg):
+    """Рисует на фоне неизменные подписи WEATHER_LABELS – получается шаблон карточки."""
+    draw = ImageDraw.Draw(bg)
+    for line, label in enumerate(WEATHER_LABELS, start=1):
+        draw.text((TEXT_X, TEXT_Y + line * LINE_HEIGHT), label, fill="black", font=FONT)
+    return bg
+
+# Шаблоны карточек готовятся один раз при старте.
+# Каждый файл декодируется один раз, даже если он общий для нескольких состояний
+BG_PATHS = set(BG_BY_WEATHER.values()) | {DEFAULT_BG_PATH}
+BG_IMAGES = {path: render_template(load_background(path)) for path in BG_PATHS}
+BG_CACHE = {main_weather: BG_IMAGES[path] for main_weather, path in BG_BY_WEATHER.items()}
+BG_CACHE["default"] = BG_IMAGES[DEFAULT_BG_PATH]
+
+# Отдельный пул для рендера: не больше RENDER_WORKERS карточек рисуются одновременно,
+# и рендер не занимает потоки общего пула asyncio
+RENDER_WORKERS = 4
+RENDER_EXECUTOR = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
+
+@functools.lru_cache(maxsize=256)
+def render_text_layer(text: str):
+    """
+    Растеризует текст в маску (режим "L") по размеру самого текста.
+    Возвращает (маска, (left, top)) – смещение маски относительно точки,
+    в которой рисовался бы текст: у глифов вроде "J" left бывает
+    отрицательным, и без смещения их край обрезался бы.
+    Одинаковые строки (температура, ветер, прогноз часто повторяются)
+    рисуются FreeType один раз, дальше – один paste на фон (см. paste_text).
+    """
+    left, top, right, bottom = MEASURE_DRAW.multiline_textbbox((0, 0), text, font=FONT, spacing=8)
+    layer = Image.new("L", (right - left, bottom - top), 0)
+    ImageDraw.Draw(layer).multiline_text((-left, -top), text, fill=255, font=FONT, spacing=8)
+    return layer, (left, top)
+
+def paste_text(bg, xy, text: str):
+    """Закрашивает чёрным текст text на bg так, как его нарисовал бы draw.text в точке xy."""
+    layer, (left, top) = render_text_layer(text)
+    bg.paste("black", (xy[0] + left, xy[1] + top), layer)
+
+def valid_coords(lat, lon):
+    """
+    Возвращает (lat, lon), если оба значения – числа (не bool) в диапазоне
+    ±90/±180, иначе None. Проверяются и ответы геокодера, и файл geo_cache:
+    туда попадает только то, что потом можно округлить и отправить в One Call.
+    """
+    for value in (lat, lon):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return (lat, lon)
+
+def load_geo_cache():
+    """Загружает geo_cache из GEO_CACHE_FILE, если файл есть."""
+    try:
+        with open(GEO_CACHE_FILE, "rb") as f:
+            saved = orjson.loads(f.read())
+    except FileNotFoundError:
+        return
+    except (OSError, orjson.JSONDecodeError) as e:
+        logger.warning(f"Не удалось прочитать {GEO_CACHE_FILE}: {e}")
+        return
+    if not isinstance(saved, dict):
+        logger.warning(f"Не удалось прочитать {GEO_CACHE_FILE}: ожидался JSON-объект")
+        return
+    loaded = 0
+    for key, coords in saved.items():
+        coords = valid_coords(*coords) if isinstance(coords, list) and len(coords) == 2 else None
+        if coords is not None:
+            geo_cache[key] = coords
+            loaded += 1
+    logger.info(f"Загружено {loaded} мест из {GEO_CACHE_FILE}")
+
+def save_geo_cache():
+    """
+    Сохраняет geo_cache в GEO_CACHE_FILE. Ненайденные названия (None) не
+    сохраняются: после перезапуска геокодер спросят о них заново.
+    """
+    found = {key: coords for key, coords in geo_cache.items() if coords is not None}
+    try:
+        with open(GEO_CACHE_FILE, "wb") as f:
+            f.write(orjson.dumps(found))
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить {GEO_CACHE_FILE}: {e}")
+
+async def geocode(client: httpx.AsyncClient, location: str, key: str):
+    """
+    Переводит название населённого пункта в координаты (lat, lon).
+    Результат навсегда сохраняется в geo_cache под ключом key. Если место
+    не найдено – None (тоже кэшируется; ошибки HTTP не кэшируются).
+    """
+    if key in geo_cache:
+        return geo_cache[key]
+
+    response = await client.get(GEOCODE_URL, params={
+        "q": location,
+        "limit": 1,
+        "appid": WEATHER_API_KEY,
+    })
+    if response.status_code != 200:
+        logger.warning(f"Геокодер ответил {response.status_code} для {location}: {response.content[:200]!r}")
+        return None
+    places = orjson.loads(response.content)
+    # Ответ 200 может оказаться ошибкой вида {"cod": 401, ...} – такое не кэшируем
+    if not isinstance(places, list) or (places and not isinstance(places[0], dict)):
+        logger.warning(f"Неожиданный ответ геокодера для {location}: {places!r:.200}")
+        return None
+
+    coords = None
+    if places:
+        coords = valid_coords(places[0].get("lat"), places[0].get("lon"))
+        if coords is None:
+            logger.warning(f"Некорректные координаты от геокодера для {location}: {places[0]!r:.200}")
+            return None
+    geo_cache[key] = coords
+    return coords
+
+async def fetch_weather(client: httpx.AsyncClient, location: str, key: str, coords):
+    """
+    Запрашивает у OWM One Call текущую погоду и почасовой прогноз (без кэша)
+    и сохраняет их в кэш. coords – (lat, lon) или None, если их нужно
+    получить геокодированием location.
+    Возвращает запись кэша (current, hourly) или None.
+    Таймауты, ошибки запроса (httpx.RequestError) и неразборчивые ответы
+    логируются и дают None.
+    """
+    try:
+        if coords is None:
+            coords = await geocode(client, location, key)
+            if coords is None:
+                return None
+        lat, lon = coords
+
+        response = await client.get(ONECALL_URL, params={
+            "lat": lat,
+            "lon": lon,
+            # Нужны только current и hourly – остальное не качаем и не парсим
+            "exclude": "minutely,daily,alerts",
+            "appid": WEATHER_API_KEY,
+            "units": "metric",
+            "lang": "ru",
+        })
+        if response.status_code != 200:
+            # Чаще всего 401: ключу нужна подписка "One Call by Call"
+            logger.warning(f"One Call ответил {response.status_code} для {location}: {response.content[:200]!r}")
+            return None
+        data = orjson.loads(response.content)
+        # Ответ 200 может оказаться ошибкой вида {"cod": 401, ...} без "current"
+        current = data.get("current") if isinstance(data, dict) else None
+        if not isinstance(current, dict) or not current.get("weather") or not CURRENT_KEYS <= current.keys():
+            logger.warning(f"Неожиданный ответ One Call для {location}: {data!r:.200}")
+            return None
+    except httpx.TimeoutException:
+        logger.warning(f"Таймаут запроса к OpenWeatherMap для: {location}")
+        return None
+    except httpx.RequestError as e:
+        # Сеть, битый Content-Encoding (DecodingError), слишком много редиректов
+        logger.warning(f"Ошибка запроса к OpenWeatherMap для {location}: {e!r}")
+        return None
+    except orjson.JSONDecodeError as e:
+        logger.warning(f"Некорректный JSON от OpenWeatherMap для {location}: {e}")
+        return None
+
+    hourly = data.get("hourly")
+    entry = (current, hourly if isinstance(hourly, list) else None)
+    weather_cache[(round(lat, 2), round(lon, 2))] = entry
+    return entry
+
+def finish_flight(flight_key, flight: asyncio.Task):
+    """
+    Убирает завершившийся запрос из inflight. Исключение забирается и логируется
+    здесь же, чтобы оно не потерялось, если все ожидающие уже были отменены.
+    """
+    inflight.pop(flight_key, None)
+    if not flight.cancelled() and flight.exception() is not None:
+        logger.error(f"Ошибка запроса погоды для {flight_key}", exc_info=flight.exception())
+
+def normalize_location(text: str):
+    """
+    Приводит ввод пользователя к виду (location, key):
+    location – NFKC-нормализованная строка для показа и запросов к OWM,
+    пробелы и переводы строк схлопнуты в один пробел: карточка рисует место
+    в одну строку над заранее нарисованными подписями,
+    key – её casefold() для кэшей, чтобы "МОСКВА", "москва" и
+    разные Unicode-записи одного названия попадали в одну запись.
+    """
+    location = " ".join(unicodedata.normalize("NFKC", text).split())
+    return location, location.casefold()
+
+async def get_weather(client: httpx.AsyncClient, location: str, key: str):
     """
     Получает данные о погоде по названию или координатам.
-    Если строка содержит запятую, пытаемся распарсить lat, lon.
-    Иначе – ищем по названию населённого пункта.
-    """
-    now = time.time()
-    key = location.lower()
-
-    if key in weather_cache:
-        timestamp, cached_current, cached_forecast = weather_cache[key]
-        if now - timestamp < CACHE_TTL:
-            logger.info(f"Используем кэш для: {location}")
-            return cached_current, cached_forecast
-
-    if ',' in location:
-        parts = location.split(',')
-        try:
-            lat = float(parts[0].strip())
-            lon = float(parts[1].strip())
-            url_current = (f"http://api.openweathermap.org/data/2.5/weather?"
-                           f"lat={lat}&lon={lon}&appid={WEATHER_API_KEY}&units=metric&lang=ru")
-            url_forecast = (f"http://api.openweathermap.org/data/2.5/forecast?"
-                            f"lat={lat}&lon={lon}&appid={WEATHER_API_KEY}&units=metric&lang=ru")
-        except ValueError:
-            url_current = (f"http://api.openweathermap.org/data/2.5/weather?"
-                           f"q={location}&appid={WEATHER_API_KEY}&units=metric&lang=ru")
-            url_forecast = (f"http://api.openweathermap.org/data/2.5/forecast?"
-                            f"q={location}&appid={WEATHER_API_KEY}&units=metric&lang=ru")
+    Если строка похожа на "широта, долгота" (COORD_RE) – запрашиваем по lat, lon;
+    координаты вне диапазона отклоняются сразу.
+    Иначе – сначала находим координаты населённого пункта через геокодер.
+    Возвращает (current, hourly) из ответа One Call или None,
+    если погоду получить не удалось.
+    Запросы идут через общий клиент client из application.bot_data.
+    Одновременные промахи кэша по одному месту ждут один общий запрос к OWM.
+    key – нормализованный ключ location (см. normalize_location).
+    """
+    match = COORD_RE.match(location)
+
+    if match:
+        coords = valid_coords(float(match[1]), float(match[2]))
+        if coords is None:
+            # Такие координаты OWM всё равно отклонит – не тратим на них запрос
+            return None
     else:
-        url_current = (f"http://api.openweathermap.org/data/2.5/weather?"
-                       f"q={location}&appid={WEATHER_API_KEY}&units=metric&lang=ru")
-        url_forecast = (f"http://api.openweathermap.org/data/2.5/forecast?"
-                        f"q={location}&appid={WEATHER_API_KEY}&units=metric&lang=ru")
+        coords = geo_cache.get(key)
+    canonical = (round(coords[0], 2), round(coords[1], 2)) if coords else None
+    cached = weather_cache.get(canonical) if canonical else None
+    if cached:
+        logger.info(f"Используем кэш для: {location}")
+        return cached
 
-    response_current = requests.get(url_current)
-    if response_current.status_code != 200:
-        return None, None
-    current_data = response_current.json()
-    if current_data.get("cod") != 200:
-        return None, None
+    flight_key = canonical or key
+    flight = inflight.get(flight_key)
+    if flight is None:
+        flight = asyncio.create_task(fetch_weather(client, location, key, coords))
+        inflight[flight_key] = flight
+        flight.add_done_callback(functools.partial(finish_flight, flight_key))
+    else:
+        logger.info(f"Ждём уже идущий запрос для: {location}")
+    # shield: отмена одного ожидающего не должна отменять запрос для остальных
+    return await asyncio.shield(flight)
 
-    response_forecast = requests.get(url_forecast)
-    forecast_data = None
-    if response_forecast.status_code == 200:
-        forecast_data = response_forecast.json()
+def _format_weather_values(location: str, current: dict):
+    """
+    Формирует значения основного блока: место, описание погоды, температура, ветер.
+    Используются и в подписи, и на картинке.
+    """
+    description = current["weather"][0]["description"].capitalize()
+    temp = current["temp"]
+    wind_speed = current["wind_speed"]
+    return (location, description, f"{temp:.1f}°C", f"{wind_speed:.1f} м/с")
+
+def _format_weather_text(weather_values: tuple):
+    """Собирает основной блок подписи: место и строки "подпись: значение"."""
+    location, *values = weather_values
+    lines = [location] + [label + value for label, value in zip(WEATHER_LABELS, values)]
+    return "\n".join(lines)
 
-    weather_cache[key] = (now, current_data, forecast_data)
-    return current_data, forecast_data
+def _format_forecast_line(current: dict, hourly: list):
+    """
+    Формирует строку краткого прогноза по следующему часу из hourly
+    (hourly[0] – текущий час, поэтому берём первую запись позже current["dt"]).
+    Если прогноза нет – возвращает пустую строку.
+    """
+    next_forecast = next((hour for hour in hourly or [] if hour["dt"] > current["dt"]), None)
+    if next_forecast is None:
+        return ""
+    forecast_weather = next_forecast["weather"][0]["main"]
+    if forecast_weather == current["weather"][0]["main"]:
+        return "Погода не изменится."
+    phrase = FORECAST_PHRASE.get(forecast_weather)
+    if phrase:
+        return phrase
+    forecast_desc = next_forecast["weather"][0]["description"].capitalize()
+    return f"Прогноз: {forecast_desc}"
 
-def generate_weather_image(weather: dict, forecast: dict, location: str):
+def generate_weather_image(main_weather: str, weather_values: tuple, forecast_line: str):
     """
     Генерирует картинку с информацией о погоде:
-      - Выбирает фоновое изображение из папки assets в зависимости от основного состояния погоды.
-      - Накладывает текст: название/координаты, температура, ветер, краткий прогноз.
-    """
-    main_weather = weather["weather"][0]["main"]
-    description = weather["weather"][0]["description"].capitalize()
-    temp = weather["main"]["temp"]
-    wind_speed = weather["wind"]["speed"]
-
-    # Выбор фонового изображения в зависимости от погоды
-    if main_weather == "Clear":
-        bg_path = "assets/sunny.png"
-    elif main_weather == "Rain":
-        bg_path = "assets/rain.png"
-    elif main_weather == "Snow":
-        bg_path = "assets/snow.png"
-    elif main_weather == "Clouds":
-        bg_path = "assets/cloudy.png"
-    elif main_weather in ["Fog", "Mist", "Haze"]:
-        bg_path = "assets/fog.png"
-    else:
-        bg_path = "assets/default.png"
+      - Выбирает шаблон (фон с подписями) в зависимости от основного состояния погоды.
+      - Накладывает место, значения из weather_values и строку прогноза (forecast_line).
+    """
+    # Выбор шаблона в зависимости от погоды
+    bg = BG_CACHE.get(main_weather, BG_CACHE["default"]).copy()
 
-    try:
-        bg = Image.open(bg_path).convert("RGBA")
-    except IOError:
-        bg = Image.new("RGBA", (800, 400), (200, 200, 200, 255))
+    # Текст – чёрный, поэтому достаточно закрасить фон через готовую маску
+    location, *values = weather_values
+    paste_text(bg, (TEXT_X, TEXT_Y), location)
+    for line, (value_x, value) in enumerate(zip(VALUE_X, values), start=1):
+        paste_text(bg, (value_x, TEXT_Y + line * LINE_HEIGHT), value)
 
-    draw = ImageDraw.Draw(bg)
-    try:
-        font = ImageFont.truetype("DejaVuSans.ttf", 36)
-    except IOError:
-        font = ImageFont.load_default()
-
-    weather_text = (
-        f"{location}\n"
-        f"Погода: {description}\n"
-        f"Температура: {temp:.1f}°C\n"
-        f"Ветер: {wind_speed:.1f} м/с"
-    )
-    draw.multiline_text((50, 50), weather_text, fill="black", font=font, spacing=8)
-
-    # Обработка прогноза
-    if forecast and "list" in forecast and len(forecast["list"]) > 0:
-        next_forecast = forecast["list"][0]
-        forecast_weather = next_forecast["weather"][0]["main"]
-        forecast_desc = next_forecast["weather"][0]["description"].capitalize()
-        if forecast_weather != main_weather:
-            if forecast_weather == "Rain":
-                forecast_message = "Прогноз: дождь. Не забудьте взять зонт!"
-            else:
-                forecast_message = f"Прогноз: {forecast_desc}"
-        else:
-            forecast_message = "Погода не изменится."
+    if forecast_line:
         # Опускаем надпись ниже (например, на координату y=250)
-        draw.text((50, 250), forecast_message, fill="black", font=font)
+        paste_text(bg, (TEXT_X, FORECAST_Y), forecast_line)
 
+    # Telegram принимает готовые bytes – без seek(0) и повторного чтения файла-объекта
     img_byte_arr = BytesIO()
-    bg.convert("RGB").save(img_byte_arr, format="PNG")
-    img_byte_arr.seek(0)
-    return img_byte_arr
+    bg.save(img_byte_arr, format="JPEG", quality=85, optimize=False, progressive=False)
+    return img_byte_arr.getvalue()
 
 async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -152,48 +425,72 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def weather_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    location = update.message.text.strip()
+    location, key = normalize_location(update.message.text)
     logger.info(f"Запрос для: {location}")
-    current_data, forecast_data = get_weather(location)
-    if current_data is None:
+    entry = await get_weather(context.bot_data["http"], location, key)
+    if entry is None:
         await update.message.reply_text(
             "Проверьте правильность ввода. Используйте формат 'Город' или 'широта, долгота'."
         )
         return
 
-    image_bytes = generate_weather_image(current_data, forecast_data, location)
+    current_data, hourly_data = entry
 
-    description = current_data["weather"][0]["description"].capitalize()
-    temp = current_data["main"]["temp"]
-    wind_speed = current_data["wind"]["speed"]
+    # Текст считается один раз и идёт и на картинку, и в подпись
+    main_weather = current_data["weather"][0]["main"]
+    weather_values = _format_weather_values(location, current_data)
+    weather_text = _format_weather_text(weather_values)
+    forecast_line = _format_forecast_line(current_data, hourly_data)
 
-    caption = (
-        f"{location}\n"
-        f"Погода: {description}\n"
-        f"Температура: {temp:.1f}°C\n"
-        f"Ветер: {wind_speed:.1f} м/с"
-    )
+    card_key = (main_weather, weather_values, forecast_line)
+    image_bytes = card_cache.get(card_key)
+    if image_bytes is None:
+        # Рендер и кодирование – CPU-работа, уводим её из event loop в пул рендера
+        image_bytes = await asyncio.get_running_loop().run_in_executor(
+            RENDER_EXECUTOR, generate_weather_image, main_weather, weather_values, forecast_line
+        )
+        card_cache[card_key] = image_bytes
 
-    if forecast_data and "list" in forecast_data and len(forecast_data["list"]) > 0:
-        next_forecast = forecast_data["list"][0]
-        forecast_weather = next_forecast["weather"][0]["main"]
-        forecast_desc = next_forecast["weather"][0]["description"].capitalize()
-        if forecast_weather != current_data["weather"][0]["main"]:
-            if forecast_weather == "Rain":
-                caption += "\nВ блажайшее время ожидается: дождь. Не забудьте взять зонт!"
-            else:
-                caption += f"\nВ ближайшее время ожидается: {forecast_desc}"
-        else:
-            caption += "\nПогода не изменится."
+    caption = weather_text
+    if forecast_line:
+        caption += f"\n{forecast_line}"
 
     await update.message.reply_photo(photo=image_bytes, caption=caption)
 
+async def post_init_handler(application):
+    load_geo_cache()
+    # Один HTTP/2-клиент на всё приложение: запросы к геокодеру и One Call
+    # мультиплексируются по одному keep-alive соединению к api.openweathermap.org
+    application.bot_data["http"] = httpx.AsyncClient(
+        timeout=REQUEST_TIMEOUT,
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        )
+    )
+
+async def shutdown_handler(application):
+    # run_polling вызывает post_shutdown и при остановке по SIGINT/SIGTERM
+    await application.bot_data["http"].aclose()
+    save_geo_cache()
+    RENDER_EXECUTOR.shutdown(wait=False)
+
 def main():
-    application = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    application = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .get_updates_connect_timeout(10)
+        .post_init(post_init_handler)
+        .post_shutdown(shutdown_handler)
+        .build()
+    )
     application.add_handler(CommandHandler("start", start_handler))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, weather_handler))
     logger.info("Бот запущен...")
-    application.run_polling()
+    # Long polling: Telegram держит getUpdates открытым до 30 с, пока нет обновлений.
+    # PTB сам прибавляет timeout к read-таймауту запроса, так что клиент не оборвёт его раньше.
+    application.run_polling(timeout=30, poll_interval=0.0, bootstrap_retries=-1)
 
 if __name__ == '__main__':
     main()